@@ -2,10 +2,37 @@
 #
 
 import numpy
+from numba import njit
 
 __all__ = ['AltitudeCalculator']
 
 
+@njit(cache=True, fastmath=True)
+def _alt_kernel(sdec_slat, cdec_clat, ha_rad, out):
+    """Altitude in radians from the hour angle in radians, ``out`` may alias ``ha_rad``."""
+    for i in range(len(ha_rad)):
+        out[i] = numpy.arcsin(sdec_slat[i] + cdec_clat[i] * numpy.cos(ha_rad[i]))
+    return out
+
+
+@njit(cache=True, fastmath=True)
+def _alt_span_kernel(sdec_slat, cdec_clat, ra, cos_delta, sin_delta, lmst_rad, indices,
+                     out_start, out_end):
+    """Altitudes in radians at ``lmst_rad`` and after each object's ``delta``.
+
+    The hour angle at the end is rotated from the one at the start with the
+    sum-of-angles identity, so only one cos/sin pair is evaluated per object.
+
+    """
+    for i in indices:
+        ha = lmst_rad - ra[i]
+        cos_ha = numpy.cos(ha)
+        sin_ha = numpy.sin(ha)
+        out_start[i] = numpy.arcsin(sdec_slat[i] + cdec_clat[i] * cos_ha)
+        out_end[i] = numpy.arcsin(sdec_slat[i] + cdec_clat[i] *
+                                  (cos_ha * cos_delta[i] - sin_ha * sin_delta[i]))
+
+
 class AltitudeCalculator(object):
     """Calculate the altitude of a constant set of objects at some global JD,
     or at a unique jd per object.
@@ -13,11 +40,15 @@ class AltitudeCalculator(object):
     This is for efficiency reasons. The intermediate cos/sin arrays of the
     coordinates are cached.
 
-    All inputs are in degrees. The output is in degrees.
+    All inputs are in degrees. The output is in radians, so that it can be
+    compared directly to limits precomputed in radians.
+
+    If ``delta``, a scalar or per-object time interval in hours, is given, the
+    `span` method returns the altitudes at both ends of that interval.
 
     """
 
-    def __init__(self, ra, dec, lon, lat):
+    def __init__(self, ra, dec, lon, lat, delta=None):
 
         self.ra = numpy.deg2rad(numpy.atleast_1d(ra))
         self.dec = numpy.deg2rad(numpy.atleast_1d(dec))
@@ -27,8 +58,18 @@ class AltitudeCalculator(object):
         self.lon = lon   # this stays in degrees
         self.sinlat = numpy.sin(numpy.radians(lat))
         self.coslat = numpy.cos(numpy.radians(lat))
-
-    def __call__(self, jd=None, lst=None):
+        # the terms of sin(alt) that do not depend on time
+        self.sindec_sinlat = self.sindec * self.sinlat
+        self.cosdec_coslat = self.cosdec * self.coslat
+
+        if delta is not None:
+            # the hour angle shift over delta does not depend on time either
+            delta_rad = numpy.broadcast_to(numpy.deg2rad(numpy.asarray(delta) * 15.),
+                                           self.ra.shape)
+            self.cos_delta = numpy.cos(delta_rad)
+            self.sin_delta = numpy.sin(delta_rad)
+
+    def __call__(self, jd=None, lst=None, out=None):
         """Object caller.
 
         Parameters
@@ -40,26 +81,74 @@ class AltitudeCalculator(object):
             Scalar or array of Local Mean Sidereal Time values, in hours.
             If array, it needs to be the same length as ``ra``, ``dec``.
             Either ``jd`` is provided, this parameter is ignored.
+        out : ~numpy.ndarray
+            Optional array of the same length as ``ra``, ``dec`` in which
+            the result is written, to avoid allocating a new array.
 
         Returns
         -------
         altitude : `float` or `~numpy.ndarray`
             An array of the same size of the inputs with the altitude of the
-            targets at ``jd`` or ``lst``, in degrees.
+            targets at ``jd`` or ``lst``, in radians.
+
+        """
+
+        lmst_rad = self._lmst_rad(jd=jd, lst=lst)
+
+        # the hour angle is computed into the output array, then converted in place
+        out = numpy.subtract(lmst_rad, self.ra, out=out)
+
+        return _alt_kernel(self.sindec_sinlat, self.cosdec_coslat, out, out)
+
+    def span(self, jd=None, lst=None, out_start=None, out_end=None, indices=None):
+        """Altitudes at a time and after the ``delta`` given on initialisation.
+
+        Parameters
+        ----------
+        jd : float
+            The JD at the start of the interval.
+        lst : float
+            The Local Mean Sidereal Time at the start of the interval, in
+            hours. If ``jd`` is provided, this parameter is ignored.
+        out_start,out_end : ~numpy.ndarray
+            Optional arrays of the same length as ``ra``, ``dec`` in which
+            the results are written.
+        indices : ~numpy.ndarray
+            Optional array of indices of the objects for which to compute
+            the altitudes. The other elements of the outputs are left
+            untouched.
+
+        Returns
+        -------
+        alt_start, alt_end : `~numpy.ndarray`
+            The altitudes of the targets at the start and end of the
+            interval, in radians.
 
         """
 
+        assert hasattr(self, 'cos_delta'), 'delta was not set on initialisation.'
+
+        if out_start is None:
+            out_start = numpy.zeros(len(self.ra))
+        if out_end is None:
+            out_end = numpy.zeros(len(self.ra))
+        if indices is None:
+            indices = numpy.arange(len(self.ra))
+
+        _alt_span_kernel(self.sindec_sinlat, self.cosdec_coslat, self.ra,
+                         self.cos_delta, self.sin_delta, float(self._lmst_rad(jd=jd, lst=lst)),
+                         indices, out_start, out_end)
+
+        return out_start, out_end
+
+    def _lmst_rad(self, jd=None, lst=None):
+        """Returns the Local Mean Sidereal Time in radians."""
+
         if numpy.any(jd) == True:
             dd = jd - 2451545.0
-            lmst_rad = numpy.deg2rad(
+            return numpy.deg2rad(
                 (280.46061837 + 360.98564736629 * dd +
                  # 0.000388 * (dd / 36525.)**2 +   # 0.1s / century, can be neglected here
                  self.lon) % 360)
         else:
-            lmst_rad = numpy.deg2rad((lst * 15) % 360.)
-
-        cosha = numpy.cos(lmst_rad - self.ra)
-        sin_alt = (self.sindec * self.sinlat +
-                   self.cosdec * self.coslat * cosha)
-
-        return numpy.rad2deg(numpy.arcsin(sin_alt))
+            return numpy.deg2rad((lst * 15) % 360.)
@@ -6,6 +6,7 @@
 # @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
 
 import numpy
+from numba import njit
 
 import lvmsurveysim.target
 from lvmsurveysim.schedule.tiledb import TileDB
@@ -16,12 +17,121 @@ from lvmsurveysim.schedule.altitude_calc import AltitudeCalculator
 
 import skyfield.api
 from lvmsurveysim.utils import shadow_height_lib
+from lvmsurveysim.utils.spherical_nb import gcd_one_to_many
 
 
-numpy.seterr(invalid='raise')
+__all__ = ['Scheduler']
 
 
-__all__ = ['Scheduler']
+@njit(cache=True)
+def _valid_mask(alt_start, alt_end, zenith_limit, min_alt, observed, total_exp, indices, out):
+    """Computes the mask of tiles observable before considering shadow height.
+
+    A tile is viable if it stays below the zenith limit and above its minimum
+    altitude for the whole exposure and is not yet complete. ``indices`` are
+    the tiles with good Moon avoidance, the criteria are combined in a single
+    pass over them and written into ``out``, which is also returned. The other
+    elements of ``out`` are left untouched.
+
+    """
+    for i in indices:
+        out[i] = (alt_start[i] < zenith_limit and alt_end[i] < zenith_limit and
+                  alt_start[i] > min_alt[i] and alt_end[i] > min_alt[i] and
+                  observed[i] < total_exp[i])
+    return out
+
+
+def _as_int16(values, name):
+    """Returns ``values`` as a contiguous int16 array, raising if they do not fit."""
+    limit = numpy.iinfo(numpy.int16).max
+    if len(values) > 0 and (values.min() < -limit or values.max() > limit):
+        raise LVMSurveyOpsError(f'{name} values must be between {-limit} and {limit}.')
+    return numpy.ascontiguousarray(values, dtype=numpy.int16)
+
+
+def _priority_groups(*keys):
+    """Groups tile indices by descending lexicographic priority.
+
+    Parameters
+    ----------
+    keys : ~numpy.ndarray
+        Integer priority arrays, the first one is the primary key.
+
+    Returns
+    -------
+    order : ~numpy.ndarray
+        Tile indices sorted by descending ``keys``. The sort is stable, so
+        tiles with equal keys keep their relative order.
+    bounds : ~numpy.ndarray
+        Group ``g`` (a single value of the keys) is ``order[bounds[g]:bounds[g + 1]]``.
+
+    """
+    order = numpy.lexsort([-k for k in reversed(keys)])
+    change = numpy.zeros(max(len(order) - 1, 0), dtype=bool)
+    for k in keys:
+        change |= numpy.diff(k[order]) != 0
+    bounds = numpy.concatenate(([0], numpy.flatnonzero(change) + 1, [len(order)]))
+    return order, bounds
+
+
+@njit(cache=True)
+def _best_in_groups(order, bounds, incomplete_only, valid_mask, hz, hz_limit, observed, alt):
+    """Returns the highest viable tile of the first group containing one.
+
+    Groups are ``order[bounds[g]:bounds[g + 1]]``, searched in order. Within a
+    group the tile with the highest altitude wins (first tile on equal altitude).
+    The maximum is reduced in scalars, returning the index and altitude of the
+    tile, or (-1, 0) if there is no viable tile.
+
+    """
+    for g in range(len(bounds) - 1):
+        best_idx = -1
+        best_alt = 0.0
+        for k in range(bounds[g], bounds[g + 1]):
+            i = order[k]
+
+            # cheapest test first, most tiles have not been started
+            if incomplete_only and not observed[i] > 0:
+                continue
+            # add shadow height to the viability criteria of the pointings
+            if not (valid_mask[i] and hz[i] > hz_limit[i]):
+                continue
+
+            if best_idx == -1 or alt[i] > best_alt:
+                best_idx = i
+                best_alt = alt[i]
+
+        if best_idx != -1:
+            return best_idx, best_alt
+
+    return -1, 0.0
+
+
+@njit(cache=True)
+def _select_tile(valid_mask, hz, hz_limit, observed, alt, tile_order, tile_bounds, prio_order, prio_bounds):
+    """Selects the best tile among the viable ones.
+
+    Tiles that have been started but are incomplete are chosen first, as if
+    they belonged to a target with higher priority than all others, searching
+    the groups of equal tile priority ``tile_order``/``tile_bounds``. Otherwise
+    the groups of equal (target priority, tile priority) ``prio_order``/``prio_bounds``
+    are searched. In both cases the highest priority group with a viable tile
+    is used and the tile with the highest altitude in it is selected.
+
+    Returns
+    -------
+    observed_idx : int
+        Index of the selected tile, or -1 if no tile is observable.
+    obs_alt : float
+        The altitude of the selected tile.
+
+    """
+    best_idx, best_alt = _best_in_groups(tile_order, tile_bounds, True, valid_mask, hz, hz_limit,
+                                         observed, alt)
+    if best_idx == -1:
+        best_idx, best_alt = _best_in_groups(prio_order, prio_bounds, False, valid_mask, hz, hz_limit,
+                                             observed, alt)
+    return best_idx, best_alt
 
 
 
@@ -35,7 +145,7 @@ class Scheduler(object):
     >>>    scheduler = Scheduler(plan)
 
     >>>    # observed exposure time for each pointing
-    >>>    observed = numpy.zeros(len(tiledb), dtype=numpy.float)
+    >>>    observed = numpy.zeros(len(tiledb), dtype=float)
 
     >>>    # range of dates for the survey
     >>>    dates = range(numpy.min(plan['JD']), numpy.max(plan['JD']) + 1)
@@ -51,6 +161,9 @@ class Scheduler(object):
     >>>                RECORD OBSERVATION of the tile
     >>>            current_jd = now()
 
+    For simulations, `schedule_night()` runs the inner loop for a whole night at once,
+    assuming every scheduled exposure is successful.
+
     Parameters
     ----------
     observing_plan : `.ObservingPlan`
@@ -59,10 +172,14 @@ class Scheduler(object):
         The plan is only used to initialize the shadow height calculator with location
         information of the observatory. The plan is not stored. The plan used for
         scheduling is passed in `prepare_for_night()`.
+    verbose_level : int
+        If > 0, invalid floating point operations in `prepare_for_night()` and
+        `get_optimal_tile()` raise an exception. Meant for debugging, the default
+        error state is used otherwise.
 
     """
 
-    def __init__(self, observing_plan):
+    def __init__(self, observing_plan, verbose_level=0):
 
         assert isinstance(observing_plan, ObservingPlan), 'observing_plan is not an instance of ObservingPlan.'
         self.observatory = observing_plan.observatory
@@ -70,6 +187,8 @@ class Scheduler(object):
         self.lat = observing_plan.location.lat.deg
 
         self.zenith_avoidance = config['scheduler']['zenith_avoidance']
+        # highest altitude allowed, in radians like all altitudes used for scheduling
+        self._zenith_limit = numpy.deg2rad(90 - self.zenith_avoidance)
 
         eph = skyfield.api.load('de421.bsp')
         self.shadow_calc = shadow_height_lib.shadow_calc(observatory_name=self.observatory, 
@@ -77,6 +196,11 @@ class Scheduler(object):
                                 observatory_lat=self.lat, observatory_lon=self.lon,
                                 eph=eph, earth=eph['earth'], sun=eph['sun'])
 
+        if verbose_level > 0:
+            self.prepare_for_night = numpy.errstate(invalid='raise')(self.prepare_for_night)
+            self.get_optimal_tile = numpy.errstate(invalid='raise')(self.get_optimal_tile)
+            self.schedule_night = numpy.errstate(invalid='raise')(self.schedule_night)
+
 
     def __repr__(self):
         return (f'<Scheduler (observing_plans={self.observatory})> ')
@@ -107,8 +231,6 @@ class Scheduler(object):
         assert isinstance(plan, ObservingPlan), \
             'one of the items in observing_plans is not an instance of ObservingPlan.'
 
-        self.maxpriority = max([t.priority for t in tiledb.targets])
-
         night_plan = plan[plan['JD'] == jd]
         self.evening_twi = night_plan['evening_twilight'][0]
         self.morning_twi = night_plan['morning_twilight'][0]
@@ -117,25 +239,59 @@ class Scheduler(object):
         # for the night for speed.
         self.lunation = night_plan['moon_phase'][0]
 
-        ra = self.tiledb.tile_table['RA'].data
-        dec = self.tiledb.tile_table['DEC'].data
+        tdb = self.tiledb.tile_arrays
+        ra = tdb['RA']
+        dec = tdb['DEC']
         
-        self.moon_to_pointings = lvmsurveysim.utils.spherical.great_circle_distance(
-                                 night_plan['moon_ra'], night_plan['moon_dec'], ra, dec)
+        # great circle distance to the Moon, using the cached trigonometry of the tiles
+        ra_rad, sin_dec, cos_dec = self.tiledb.get_trig_coords()
+        self.moon_to_pointings = gcd_one_to_many(numpy.deg2rad(night_plan['moon_ra'][0]),
+                                                 numpy.deg2rad(night_plan['moon_dec'][0]),
+                                                 sin_dec, cos_dec, ra_rad,
+                                                 numpy.empty(len(ra_rad)))
 
         # set the coordinates to all targets in shadow height calculator
         self.shadow_calc.set_coordinates(ra, dec)
 
-        # Fast altitude calculator
-        self.ac = AltitudeCalculator(ra, dec, self.lon, self.lat)
-
-        # convert airmass to altitude, we'll work in altitude space for efficiency
-        tdb = self.tiledb.tile_table
-        self.min_alt_for_target = 90.0 - numpy.rad2deg(numpy.arccos(1.0 / tdb['AirmassLimit'].data))
+        # convert airmass to altitude in radians, we'll work in altitude space for efficiency
+        self.min_alt_for_target = numpy.pi / 2 - numpy.arccos(1.0 / tdb['AirmassLimit'])
 
         # Select targets that are above the max airmass and with good
         # moon avoidance.
-        self.moon_ok = (self.moon_to_pointings > tdb['MoonDistanceLimit'].data) & (self.lunation <= tdb['LunationLimit'].data)
+        self.moon_ok = (self.moon_to_pointings > tdb['MoonDistanceLimit']) & (self.lunation <= tdb['LunationLimit'])
+        # Moon avoidance does not change during the night, so the per-exposure
+        # computations are restricted to these tiles.
+        self._moon_ok_idx = numpy.flatnonzero(self.moon_ok).astype(numpy.int32)
+
+        # cache the columns needed for each exposure with the dtypes used by the kernels
+        self._visit_exp = tdb['VisitExptime'].astype(numpy.float64, copy=False)
+        self._total_exp = tdb['TotalExptime'].astype(numpy.float64, copy=False)
+        self._hz_limit = tdb['HzLimit'].astype(numpy.float64, copy=False)
+        self._visit_exp_hours = self._visit_exp / 3600.0
+
+        # Fast altitude calculator, for the start and end of each tile's exposure
+        self.ac = AltitudeCalculator(ra, dec, self.lon, self.lat, delta=self._visit_exp_hours)
+
+        # priorities are small integers, int16 keeps the grouping below compact
+        self._target_prio = _as_int16(tdb['TargetPriority'], 'TargetPriority')
+        self._tile_prio = _as_int16(tdb['TilePriority'], 'TilePriority')
+
+        # Group the tiles by the lexicographic key (target priority, tile priority), highest
+        # first. Priorities are constant for the night, so get_optimal_tile() only walks
+        # these groups in order, stops at the first one containing a viable tile and
+        # picks the highest altitude tile in it. Incomplete tiles take precedence over
+        # all targets, they are grouped by tile priority alone.
+        self._prio_order, self._prio_bounds = _priority_groups(self._target_prio, self._tile_prio)
+        self._tile_order, self._tile_bounds = _priority_groups(self._tile_prio)
+
+        # reusable buffers for the per-exposure altitudes, mask of viable tiles
+        # and shadow heights. Only the elements of Moon-ok tiles are ever written,
+        # the mask of the other tiles stays False for the whole night.
+        self._alt_start = numpy.zeros(len(ra))
+        self._alt_end = numpy.zeros(len(ra))
+        self._mask_buf = numpy.zeros(len(ra), dtype=bool)
+        self._hz = numpy.zeros(len(ra))
+        self._valid_idx = numpy.zeros(0, dtype=numpy.int32)
 
 
     def get_optimal_tile(self, jd, observed):
@@ -177,7 +333,7 @@ class Scheduler(object):
         hz : float
             The shadow height for the observation
         alt : float
-            The altitude of the observation
+            The altitude of the observation in degrees
         lunation : float
             The lunation at time of the observation
 
@@ -186,96 +342,104 @@ class Scheduler(object):
         if jd >= self.morning_twi or jd < self.evening_twi:
             raise LVMSurveyOpsError(f'the time {jd} is not between {self.evening_twi} and {self.morning_twi}.')
         
-        tdb = self.tiledb.tile_table
-        if len(tdb) != len(observed):
-            raise LVMSurveyOpsError(f'length of tiledb {len(tdb)} != length of observed array {len(observed)}.')
+        if len(self._total_exp) != len(observed):
+            raise LVMSurveyOpsError(f'length of tiledb {len(self._total_exp)} != length of observed array {len(observed)}.')
 
-        # Get current LST
-        lst = lvmsurveysim.utils.spherical.get_lst(jd, self.lon)
+        return self._optimal_tile(jd, observed)
 
-        # advance shadow height calculator to current time
-        self.shadow_calc.update_time(jd=jd)
 
-        # Get the altitude at the start and end of the proposed exposure.
-        alt_start = self.ac(lst=lst)
-        alt_end = self.ac(lst=(lst + (tdb['VisitExptime'].data / 3600.)))
+    def schedule_night(self, observed, time_step):
+        """Schedules the whole night previously passed to `prepare_for_night()`.
 
-        # avoid the zenith!
-        alt_ok = (alt_start < (90 - self.zenith_avoidance)) & (alt_end < (90 - self.zenith_avoidance))
+        Starting at evening twilight, repeatedly selects the optimal tile, gives it
+        one visit of exposure time and advances the time by the exposure time times
+        the target overhead (or by ``time_step`` if no tile is observable) until
+        morning twilight. This is equivalent to calling `get_optimal_tile()` in a loop,
+        but the argument checks and per-night quantities are handled once for the night.
 
-        # Gets valid airmasses (but we're working in altitude space)
-        airmass_ok = ((alt_start > self.min_alt_for_target) & (alt_end > self.min_alt_for_target))
+        Parameters
+        ----------
+        observed : ~numpy.array
+            Same length as len(tiledb).
+            Array containing the exposure time already executed for each tile in the tiledb.
+            It is updated in place with the exposures scheduled for the night.
+        time_step : float
+            Time in seconds to advance when no tile is observable.
 
-        # Gets pointings that haven't been completely observed
-        exptime_ok = observed < tdb['TotalExptime'].data
+        Returns
+        -------
+        sequence : list of tuple
+            One ``(jd, observed_idx, lst, hz, alt, lunation, exptime, totaltime)`` tuple
+            for each step of the night, with the values returned by `get_optimal_tile()`,
+            the exposure time and the total time including overhead in seconds.
+            ``observed_idx`` is -1 if no tile was observable at ``jd``.
 
-        # Creates a mask of viable pointings with correct Moon avoidance,
-        # airmass, zenith avoidance and that have not been completed.
-        valid_mask = alt_ok & self.moon_ok & airmass_ok & exptime_ok
+        """
 
-        # calculate shadow heights, but only for the viable pointings since it is a costly computation
-        hz = numpy.full(len(alt_ok), 0.0)
-        hz_valid = self.shadow_calc.get_heights(return_heights=True, mask=valid_mask, unit="km")
-        hz[valid_mask] = hz_valid
-        hz_ok = (hz > tdb['HzLimit'].data)
+        if len(self._total_exp) != len(observed):
+            raise LVMSurveyOpsError(f'length of tiledb {len(self._total_exp)} != length of observed array {len(observed)}.')
 
-        # add shadow height to the viability criteria of the pointings to create the final 
-        # subset that are candidates for observation
-        valid_idx = numpy.where(valid_mask & hz_ok)[0]
+        target_overhead = numpy.array([t.overhead for t in self.tiledb.targets], dtype=float)
+        overhead = target_overhead[self.tiledb.tile_arrays['TargetIndex']]
 
-        # If there's nothing to observe, return -1
-        if len(valid_idx) == 0:
-            return -1, lst, 0, 0, self.lunation
+        sequence = []
 
-        # Find observations that have nonzero exposure but are incomplete
-        incomplete = (observed > 0) & (observed < tdb['TotalExptime'].data)
+        # begin at twilight
+        jd = self.evening_twi
+        while jd < self.morning_twi:
 
-        target_priorities = tdb['TargetPriority'].data
-        tile_priorities = tdb['TilePriority'].data
+            observed_idx, lst, hz, alt, lunation = self._optimal_tile(jd, observed)
+            if observed_idx == -1:
+                # nothing available
+                exptime = time_step
+                totaltime = time_step
+            else:
+                # observe it, give it one quantum of exposure
+                exptime = self._visit_exp[observed_idx]
+                totaltime = exptime * overhead[observed_idx]
+                observed[observed_idx] += exptime
 
-        # Gets the coordinates, altitudes, and priorities of possible pointings.
-        valid_alt = alt_start[valid_idx]
-        valid_priorities = target_priorities[valid_idx]
-        valid_incomplete = incomplete[valid_idx]
-        valid_tile_priorities = tile_priorities[valid_idx]
+            sequence.append((jd, observed_idx, lst, hz, alt, lunation, exptime, totaltime))
+            jd += totaltime / 86400.0
 
-        # Give incomplete observations the highest priority, imitating a high-priority target,
-        # that makes sure these are completed first in all visible targets
-        valid_priorities[valid_incomplete] = self.maxpriority + 1
+        return sequence
 
-        # Loops starting with targets with the highest priority (lowest numerical value).
-        for priority in numpy.flip(numpy.unique(valid_priorities), axis=0):
 
-            # Gets the indices that correspond to this priority (note that
-            # these indices correspond to positions in valid_idx, not in the
-            # master list).
-            valid_priority_idx = numpy.where(valid_priorities == priority)[0]
+    def _optimal_tile(self, jd, observed):
+        """Implements `get_optimal_tile()` without checking the arguments."""
 
-            # If there's nothing to do at the current priority, try the next lower
-            if len(valid_priority_idx) == 0:
-                continue
+        # Get current LST
+        lst = lvmsurveysim.utils.spherical.get_lst(jd, self.lon)
+
+        # advance shadow height calculator to current time
+        self.shadow_calc.update_time(jd=jd)
 
-            # select all pointings with the current target priority
-            valid_alt_target_priority = valid_alt[valid_priority_idx]
-            valid_alt_tile_priority = valid_tile_priorities[valid_priority_idx]
+        # Get the altitude at the start and end of the proposed exposure.
+        moon_ok_idx = self._moon_ok_idx
+        alt_start, alt_end = self.ac.span(lst=lst, out_start=self._alt_start,
+                                          out_end=self._alt_end, indices=moon_ok_idx)
 
-            # Find the tiles with the highest tile priority
-            max_tile_priority = numpy.max(valid_alt_tile_priority)
-            high_priority_tiles = numpy.where(valid_alt_tile_priority == max_tile_priority)[0]
+        # Only the shadow heights of the previous call's viable tiles are nonzero.
+        hz = self._hz
+        hz[self._valid_idx] = 0.0
 
-            # Gets the pointing with the highest altitude * shadow height
-            obs_alt_idx = (valid_alt_target_priority[high_priority_tiles]).argmax()
-            #obs_alt_idx = (hz[valid_priority_idx[high_priority_tiles]] * valid_alt_target_priority[high_priority_tiles]).argmax()
-            #obs_alt_idx = hz[valid_priority_idx[high_priority_tiles]].argmax()
-            obs_tile_idx = high_priority_tiles[obs_alt_idx]
-            obs_alt = valid_alt_target_priority[obs_tile_idx]
+        # Creates a mask of viable pointings with correct Moon avoidance,
+        # airmass, zenith avoidance and that have not been completed.
+        valid_mask = _valid_mask(alt_start, alt_end, self._zenith_limit, self.min_alt_for_target,
+                                 observed, self._total_exp, moon_ok_idx, self._mask_buf)
 
-            # Gets the index of the pointing in the master list.
-            observed_idx = valid_idx[valid_priority_idx[obs_tile_idx]]
+        # calculate shadow heights, but only for the viable pointings since it is a costly computation
+        valid_idx = self._valid_idx = moon_ok_idx[valid_mask[moon_ok_idx]]
+        hz[valid_idx] = self.shadow_calc.get_heights(return_heights=True, indices=valid_idx, unit="km")
 
-            return observed_idx, lst, hz[observed_idx], obs_alt, self.lunation
+        # Pick the tile with the highest target priority, then tile priority, then altitude.
+        observed_idx, obs_alt = _select_tile(valid_mask, hz, self._hz_limit, observed, alt_start,
+                                             self._tile_order, self._tile_bounds,
+                                             self._prio_order, self._prio_bounds)
 
-        assert False, "Unreachable code!"
-        return -1,0   # should never be reached
+        # If there's nothing to observe, return -1
+        if observed_idx == -1:
+            return -1, lst, 0, 0, self.lunation
 
+        return observed_idx, lst, hz[observed_idx], numpy.rad2deg(obs_alt), self.lunation
 
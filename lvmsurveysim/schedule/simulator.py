@@ -22,9 +22,6 @@ from lvmsurveysim.schedule.plan import ObservingPlan
 from lvmsurveysim.utils.plot import __MOLLWEIDE_ORIGIN__, get_axes, transform_patch_mollweide, convert_to_mollweide
 
 
-numpy.seterr(invalid='raise')
-
-
 __all__ = ['Simulator']
 
 
@@ -62,7 +59,7 @@ class Simulator(object):
 
         # get rid of the special tiles, we do not need them for the simulator
         tdb = tiledb.tile_table
-        tiledb.tile_table = tdb[numpy.where(tdb['TileID'] >= tiledb.tileid_start)[0]]
+        tiledb.tile_table = tdb[numpy.flatnonzero(tdb['TileID'] >= tiledb.tileid_start)]
 
         if observing_plan is None:
             observing_plan = self._create_observing_plan()
@@ -203,40 +200,31 @@ class Simulator(object):
         scheduler.prepare_for_night(jd, self.observing_plan, self.tiledb)
 
         # shortcut
-        tdb = self.tiledb.tile_table
+        tdb = self.tiledb.tile_arrays
 
-        # begin at twilight
-        current_jd = scheduler.evening_twi
+        # schedule the whole night, 'observed' is updated with the exposures taken
+        sequence = scheduler.schedule_night(observed, self.time_step)
 
-        # While the current time is before morning twilight ...
-        while current_jd < scheduler.morning_twi:
+        for current_jd, observed_idx, current_lst, hz, alt, lunation, exptime, totaltime in sequence:
 
-            # obtain the next tile to observe
-            observed_idx, current_lst, hz, alt, lunation = scheduler.get_optimal_tile(current_jd, observed)
             if observed_idx == -1:
                 # nothing available
                 self._record_observation(current_jd, self.observing_plan.observatory,
                                          lst=current_lst,
-                                         exptime=self.time_step,
-                                         totaltime=self.time_step)
-                current_jd += (self.time_step) / 86400.0
+                                         exptime=exptime,
+                                         totaltime=totaltime)
                 continue
 
-            # observe it, give it one quantum of exposure
-            exptime = tdb['VisitExptime'].data[observed_idx]
-            observed[observed_idx] += exptime
-
             # collect observation data to put in table
-            tileid_observed = tdb['TileID'].data[observed_idx]
-            target_index = tdb['TargetIndex'].data[observed_idx]
+            tileid_observed = tdb['TileID'][observed_idx]
+            target_index = tdb['TargetIndex'][observed_idx]
             target_name = self.targets[target_index].name
             groups = self.targets[target_index].groups
             target_group = groups[0] if groups else 'None'
-            target_overhead = self.targets[target_index].overhead
 
             # Get the index of the first value in index_to_target that matches
             # the index of the target.
-            target_index_first = numpy.nonzero(tdb['TargetIndex'].data == target_index)[0][0]
+            target_index_first = numpy.flatnonzero(tdb['TargetIndex'] == target_index)[0]
             # Get the index of the pointing within its target.
             pointing_index = observed_idx - target_index_first
             
@@ -250,18 +238,16 @@ class Simulator(object):
                                         target_group=target_group,
                                         tileid = tileid_observed,
                                         pointing_index=pointing_index,
-                                        ra=tdb['RA'].data[observed_idx], 
-                                        dec=tdb['DEC'].data[observed_idx],
-                                        pa=tdb['PA'].data[observed_idx],
+                                        ra=tdb['RA'][observed_idx], 
+                                        dec=tdb['DEC'][observed_idx],
+                                        pa=tdb['PA'][observed_idx],
                                         airmass=airmass,
                                         lunation=lunation,
                                         shadow_height= hz, #hz[valid_priority_idx[obs_tile_idx]],
                                         dist_to_moon=dist_to_moon,
                                         lst=current_lst,
                                         exptime=exptime,
-                                        totaltime=exptime * target_overhead)
-
-            current_jd += exptime * target_overhead / 86400.0
+                                        totaltime=totaltime)
 
 
     def animate_survey(self, filename='lvm_survey.mp4', step=100,
@@ -29,13 +29,10 @@ import lvmsurveysim.schedule.opsdb as opsdb
 from lvmsurveysim.utils.plot import __MOLLWEIDE_ORIGIN__, get_axes, transform_patch_mollweide, convert_to_mollweide
 from lvmsurveysim.target.skyregion import SkyRegion
 
-numpy.seterr(invalid='raise')
-
 
 __all__ = ['TileDB']
 
 
-
 class TileDB(object):
     """Database holding a list of tiles to observe. Persistence is provided 
     through the OpsDB interface. The operations SQL database is the default.
@@ -88,6 +85,10 @@ class TileDB(object):
         than keeping the data as a collection of tiles.
         We ensure synchronicity between updates to the Table and updates to the 
         database.
+    tile_arrays : dict
+        The columns of ``tile_table`` as contiguous `~numpy.ndarray` keyed by
+        column name, rebuilt when a new table is set. Schedulers should read
+        tile data from here rather than from the Table, which is kept for I/O.
     """
 
     def __init__(self, targets, tile_tab=None, tileid_start=None):
@@ -108,7 +109,7 @@ class TileDB(object):
         """
         assert isinstance(targets, lvmsurveysim.target.TargetList), "TargetList object expected in ctor of TileDB"
         self.targets = targets    # instance of lvmsurveysim.target.TargetList
-        self.tiles = None         # dict of target-number to list of lvmsurveysim.target.Tile
+        self.tiles = None         # dict of target-number to object array of lvmsurveysim.target.Tile
         self.tile_table = tile_tab# will hold astropy.Table of tile data
         self.tileid_start = tileid_start or int(config['tiledb']['tileid_start']) # start value for tile ids
         assert self.tileid_start > -1, "tileid_start value invalid, must be 0 or greater integer"
@@ -116,7 +117,42 @@ class TileDB(object):
     def __repr__(self):
         return (f'<TileDB (N_tiles={len(self.tile_table)})>')
 
+    @property
+    def tile_table(self):
+        """The `~astropy.table.Table` of tiles. Setting a new table drops the
+        quantities cached from the previous one."""
+        return self._tile_table
+
+    @tile_table.setter
+    def tile_table(self, tile_table):
+        self._tile_table = tile_table
+        self._trig_coords = None
+        self._tileid_to_row = None
+        if tile_table is None:
+            self.tile_arrays = None
+        else:
+            self.tile_arrays = {name: numpy.ascontiguousarray(tile_table[name].data)
+                                for name in tile_table.colnames}
+
+    def get_trig_coords(self):
+        """Return the tile coordinates in the form used by spherical trigonometry.
+
+        The tile coordinates do not change during scheduling, so these are
+        computed on first use and cached until a new tile table is set.
+
+        Returns
+        -------
+        ra_rad, sin_dec, cos_dec : ~numpy.array
+            RA in radians and sine and cosine of the declination of each tile.
+        """
+        if self._trig_coords is None:
+            dec_rad = numpy.deg2rad(self.tile_arrays['DEC'])
+            self._trig_coords = (numpy.deg2rad(self.tile_arrays['RA']),
+                                 numpy.sin(dec_rad), numpy.cos(dec_rad))
+        return self._trig_coords
+
 
+    @numpy.errstate(invalid='raise')
     def tile_targets(self, ifu=None):
         '''
         Tile a set of Targets with a given IFU. Overlapping targets are tiled such
@@ -134,6 +170,7 @@ class TileDB(object):
         self.ifu = ifu or IFU.from_config()
         self.tiling_type = 'hexagonal'
         self.tiles = {}
+        self._tile_coords = {}    # dict of target-number to arrays of tile RA, Dec and PA
 
         # tile tile unions first:
         for tu in self.targets.get_tile_unions():
@@ -153,7 +190,12 @@ class TileDB(object):
             if t.tile_union == None:
                 # if we have not tiled the target yet as part of a tile union, tile now
                 t.tile(ifu=self.ifu, to_frame='icrs')
-            self.tiles[i] = t.make_tiles() # populate the tile database with Tile rows
+            # populate the tile database with Tile rows, kept in an object array for mask slicing
+            self.tiles[i] = numpy.asarray(t.make_tiles(), dtype=object)
+            # the coordinates in degrees, extracted once from the target's SkyCoord array
+            self._tile_coords[i] = (numpy.array(t.tiles.ra.deg, dtype=float, ndmin=1),
+                                    numpy.array(t.tiles.dec.deg, dtype=float, ndmin=1),
+                                    numpy.array(t.pa.deg, dtype=float, ndmin=1))
 
         # Remove pointings that overlap with other regions.
         self._remove_overlap()
@@ -174,14 +216,19 @@ class TileDB(object):
             the new status word.
 
         """
-        idx = numpy.where(self.tile_table['TileID'] == tileid)[0]
-        if len(idx) != 1:
+        if self._tileid_to_row is None:
+            # row lookup by tile id, built on first use and dropped with the table
+            self._tileid_to_row = dict(zip(self.tile_table['TileID'].tolist(),
+                                           range(len(self.tile_table))))
+        idx = self._tileid_to_row.get(tileid)
+        if idx is None:
             raise LVMSurveyOpsError(f'tileid {tileid} not found')
 
         # Update record in database first, then update the cached table
         s = opsdb.OpsDB.update_tile_status(tileid, status)
         assert s==1, 'Database error, more than one tileid updated.'
         self.tile_table['Status'][idx] = status
+        self.tile_arrays['Status'][idx] = status
 
 
     def plot(self, target=None, projection='mollweide', fast=False, annotate=False, alpha=0.75):
@@ -229,7 +276,8 @@ class TileDB(object):
             else:
                 x,y = data['RA'], data['DEC']
             tt = [target.name for target in self.targets]
-            g = numpy.array([tt.index(i) for i in data['Target']], dtype=float)
+            # the table already records the index of each tile's target
+            g = data['TargetIndex'].data.astype(float)
             ax.scatter(x, y, c=g % 19, s=0.05, edgecolor=None, edgecolors=None, cmap='tab20')
             if annotate is True:
                 _, text_indices = numpy.unique(g, return_index=True)
@@ -237,16 +285,19 @@ class TileDB(object):
                     plt.text(x[text_indices[i]], y[text_indices[i]], tt[i], fontsize=9)
         else:
             ifu = IFU.from_config()
+            target_index = data['TargetIndex'].data
+            ra, dec, pa = data['RA'].data, data['DEC'].data, data['PA'].data
             for ii, sty in zip(range(len(self.targets)), itertools.cycle(color_cycler)):
 
                 target = self.targets[ii]
-                name = target.name
 
-                target_data = data[data['Target'] == name]
+                # plain arrays, to avoid building a Table row per tile
+                in_target = target_index == ii
+                ras, decs, pas = ra[in_target], dec[in_target], pa[in_target]
 
-                patches = [ifu.get_patch(scale=target.telescope.plate_scale, centre=[p['RA'], p['DEC']], pa=p['PA'],
+                patches = [ifu.get_patch(scale=target.telescope.plate_scale, centre=[ras[k], decs[k]], pa=pas[k],
                                          edgecolor='None', linewidth=0.0, alpha=alpha, facecolor=sty['bgcolor'])[0]
-                           for p in target_data]
+                           for k in range(len(ras))]
 
                 if projection == 'mollweide':
                     patches = [transform_patch_mollweide(patch) for patch in patches]
@@ -266,57 +317,59 @@ class TileDB(object):
         # for scheduling
         s = sorted(self.tiles)
 
+        # Number of tiles of each target. Values that are constant for a target are
+        # repeated for all its tiles in a single numpy.repeat call.
+        sizes = numpy.array([len(self.tiles[idx]) for idx in s], dtype=int)
+        targets = [self.targets[idx] for idx in s]
+
+        def per_target(values):
+            return numpy.repeat(numpy.array(values), sizes)
+
         # An array with the length of all the pointings indicating the index
         # of the target it correspond to.
-        target_idx = numpy.concatenate([numpy.repeat(idx, len(self.tiles[idx])) for idx in s])
+        target_idx = per_target(s)
 
         # unique tile IDs
         tileid = numpy.array(range(self.tileid_start, self.tileid_start+len(target_idx)), dtype=int)
 
         # An array with the target name
-        target = numpy.concatenate([numpy.repeat(self.targets[idx].name, len(self.tiles[idx])) for idx in s])
+        target = per_target([t.name for t in targets])
 
         # An array with the target name
-        telescope = numpy.concatenate([numpy.repeat(self.targets[idx].telescope.name, len(self.tiles[idx])) for idx in s])
+        telescope = per_target([t.telescope.name for t in targets])
 
-        # All the coordinates and position angles
-        ra = numpy.concatenate([[t.coords.ra.deg for t in self.tiles[idx]] for idx in s])
-        dec = numpy.concatenate([[t.coords.dec.deg for t in self.tiles[idx]] for idx in s])
-        tile_pa = numpy.concatenate([[t.pa.deg for t in self.tiles[idx]] for idx in s])
+        # All the coordinates and position angles, these were extracted when tiling
+        ra = numpy.concatenate([self._tile_coords[idx][0] for idx in s])
+        dec = numpy.concatenate([self._tile_coords[idx][1] for idx in s])
+        tile_pa = numpy.concatenate([self._tile_coords[idx][2] for idx in s])
 
-        # Create an array of the target's priority for each pointing
-        target_prio = numpy.concatenate([numpy.repeat(self.targets[idx].priority, len(self.tiles[idx])) for idx in s])
+        # Array with the individual tile priorities, filled target by target
+        offsets = numpy.cumsum(numpy.concatenate([[0], sizes]))
+        tile_prio = numpy.empty(offsets[-1], dtype=int)
+        for k, idx in enumerate(s):
+            tile_prio[offsets[k]:offsets[k + 1]] = numpy.fromiter((t.priority for t in self.tiles[idx]),
+                                                                  dtype=int, count=sizes[k])
 
-        # Array with the individual tile priorities
-        tile_prio = numpy.concatenate([[t.priority for t in self.tiles[idx]] for idx in s])
+        # Create an array of the target's priority for each pointing
+        target_prio = per_target([t.priority for t in targets])
 
         # Array with the total exposure time for each tile
-        target_exposure_times = numpy.concatenate(
-            [numpy.repeat(self.targets[idx].exptime * self.targets[idx].n_exposures, len(self.tiles[idx]))
-             for idx in s])
+        target_exposure_times = per_target([t.exptime * t.n_exposures for t in targets])
 
         # Array with exposure quanta (the minimum time to spend on a tile)
-        exposure_quantums = numpy.concatenate(
-            [numpy.repeat(self.targets[idx].exptime * self.targets[idx].min_exposures, len(self.tiles[idx]))
-             for idx in s])
+        exposure_quantums = per_target([t.exptime * t.min_exposures for t in targets])
 
         # Array with the airmass limit for each pointing
-        max_airmass_to_target = numpy.concatenate([numpy.repeat(self.targets[idx].max_airmass, len(self.tiles[idx])) for idx in s])
+        max_airmass_to_target = per_target([t.max_airmass for t in targets])
 
         # Array with the airmass limit for each pointing
-        min_shadowheight_to_target = numpy.concatenate(
-            [numpy.repeat(self.targets[idx].min_shadowheight, len(self.tiles[idx]))
-             for idx in s])
+        min_shadowheight_to_target = per_target([t.min_shadowheight for t in targets])
 
         # Array with the airmass limit for each pointing
-        min_moon_to_target = numpy.concatenate(
-            [numpy.repeat(self.targets[idx].min_moon_dist, len(self.tiles[idx]))
-             for idx in s])
+        min_moon_to_target = per_target([t.min_moon_dist for t in targets])
 
         # Array with the lunation limit for each pointing
-        max_lunation = numpy.concatenate(
-            [numpy.repeat(self.targets[idx].max_lunation, len(self.tiles[idx]))
-             for idx in s])
+        max_lunation = per_target([t.max_lunation for t in targets])
 
         # status flags for the tiles
         status = numpy.full(len(tileid), 0, dtype=numpy.int64)
@@ -338,7 +391,7 @@ class TileDB(object):
         Tile retention rules for two overlapping targets are given by
         ._overlap_matrix`.
 
-        Modifies the self.tiles list to preserve a set of non-overlapping tiles.
+        Modifies the self.tiles arrays to preserve a set of non-overlapping tiles.
 
         '''
         # Calculate overlap but don't apply the masks
@@ -349,7 +402,9 @@ class TileDB(object):
 
             # Remove the overlapping tiles from the pointings and
             # remove their tile priorities.            
-            self.tiles[ii] = list(itertools.compress(self.tiles[ii], overlap[tname]['global_no_overlap']))
+            keep = overlap[tname]['global_no_overlap']
+            self.tiles[ii] = self.tiles[ii][keep]
+            self._tile_coords[ii] = tuple(c[keep] for c in self._tile_coords[ii])
 
             if len(self.tiles[ii]) == 0:
                 warnings.warn(f'target {tname} completely overlaps with other '
@@ -394,6 +449,24 @@ class TileDB(object):
             return i_dens >= j_dens
 
 
+    @staticmethod
+    def _caps_disjoint(cap_i, cap_j):
+        """Returns True if two bounding caps certainly do not intersect.
+
+        The caps are disjoint if the angle between their centers is larger
+        than the sum of their radii. Missing caps are never disjoint.
+
+        The caps bound the geometric regions, so pruning a pair with them is
+        only equivalent to calling ``intersects_poly`` if `spherical_geometry`
+        sees the same regions, which requires polygons without degenerate
+        edges (see `.SkyRegion.icrs_region`).
+        """
+        if cap_i is None or cap_j is None:
+            return False
+        radii = numpy.arccos(cap_i[1]) + numpy.arccos(cap_j[1])
+        return radii < numpy.pi and numpy.dot(cap_i[0], cap_j[0]) < numpy.cos(radii) - 1e-9
+
+
     def _get_overlap(self, verbose_level=1):
         """Returns a dictionary of masks with the overlap between regions."""
 
@@ -425,17 +498,30 @@ class TileDB(object):
                         overlap[self.targets[j].name][self.targets[idx].name] = numpy.full(len(self.tiles[j]), False)
                         overlap[self.targets[idx].name][self.targets[j].name] = numpy.full(len(self.tiles[idx]), False)
 
+        # The ICRS regions of the non-geodesic targets and the tile coordinates of all
+        # targets that take part in the overlap are computed once, not for every pair.
+        icrs_regions = {}
+        icrs_caps = {}
+        tile_lon = {}
+        tile_lat = {}
+        for idx in s:
+            if self.targets[idx].overlap:
+                if self.targets[idx].geodesic == False:
+                    icrs_regions[idx] = self.targets[idx].region.icrs_region()
+                    icrs_caps[idx] = icrs_regions[idx].bounding_cap()
+                tile_lon[idx], tile_lat[idx], _ = self._tile_coords[idx]
+
         for i in s:
             if self.targets[i].overlap and (self.targets[i].geodesic == False):
-                # make sure we have everything in ICRS
-                poly_i = self.targets[i].region.icrs_region()
-
+                poly_i = icrs_regions[i]
                 for j in s:
                     if (j != i) and self.targets[j].overlap:
                         if (self.targets[j].geodesic == False):  # non-geodesic: check for rules
-                            # make sure we have everything in ICRS
-                            poly_j = self.targets[j].region.icrs_region()
-                            may_overlap = self._overlap_matrix(poly_i, poly_j, self.targets[i], self.targets[j])
+                            poly_j = icrs_regions[j]
+                            if not self._caps_disjoint(icrs_caps[i], icrs_caps[j]):
+                                may_overlap = self._overlap_matrix(poly_i, poly_j, self.targets[i], self.targets[j])
+                            else:
+                                may_overlap = False
                         else:
                             may_overlap = True   #geodesic targets always lose their tiles
 
@@ -443,28 +529,41 @@ class TileDB(object):
                             #print(overl, self.targets[i].name, self.targets[j].name)
 
                             # shapes overlap, so now find all tiles of j that are within i:
-                            lon_j = [t.coords.ra.deg for t in self.tiles[j]] 
-                            lat_j = [t.coords.dec.deg for t in self.tiles[j]]
+                            lon_j = tile_lon[j]
+                            lat_j = tile_lat[j]
 
-                            #Initialize array to True. This doesn't matter. We loop over all values anyway, but it's nice.
-                            overlap[names[j]][names[i]] = numpy.full(len(self.tiles[j]), False)
+                            # Tiles outside the bounding cap of i cannot be inside i, only the
+                            # others need the point-in-polygon test.
+                            no_overlap = numpy.ones(len(self.tiles[j]), dtype=bool)
                             t_start = time.time()
-                            # Check array to see which is false.
-                            for k in range(len(lon_j)):
-                                contains_i_j = poly_i.contains_point(lon_j[k], lat_j[k])
-
-                                overlap[names[j]][names[i]][k] = numpy.logical_not(contains_i_j)
-
-                                if contains_i_j and (verbose_level >= 2):
+                            if icrs_caps[i] is None:
+                                candidates = numpy.arange(len(lon_j))
+                            else:
+                                center, cos_radius = icrs_caps[i]
+                                cos_lat_j = numpy.cos(numpy.deg2rad(lat_j))
+                                cos_d = (cos_lat_j * numpy.cos(numpy.deg2rad(lon_j)) * center[0] +
+                                         cos_lat_j * numpy.sin(numpy.deg2rad(lon_j)) * center[1] +
+                                         numpy.sin(numpy.deg2rad(lat_j)) * center[2])
+                                candidates = numpy.flatnonzero(cos_d >= cos_radius - 1e-9)
+
+                            # Clear the tiles of j that are inside i.
+                            inside = candidates[poly_i.contains_points(lon_j[candidates], lat_j[candidates])]
+                            no_overlap[inside] = False
+                            if verbose_level >= 2:
+                                for k in inside:
                                     print("%s x %s overlap at %f, %f"%(self.targets[i].name, self.targets[j].name, lon_j[k], lat_j[k]))
                             
                             if verbose_level >=1:
                                 print("%s x %s Overlap loop exec time(s)= %f"%(self.targets[i].name, self.targets[j].name, time.time()-t_start))
-                        else:
-                            overlap[names[j]][names[i]] = numpy.full(len(self.tiles[j]), True)
 
-                        # For functional use, create a global overlap mask, to be used when scheduling
-                        overlap[names[j]]['global_no_overlap'] &= overlap[names[j]][names[i]]
+                            overlap[names[j]][names[i]] = no_overlap
+
+                            # For functional use, create a global overlap mask, to be used when scheduling.
+                            # Pairs without overlap leave it unchanged.
+                            global_no_overlap = overlap[names[j]]['global_no_overlap']
+                            numpy.logical_and(global_no_overlap, no_overlap, out=global_no_overlap)
+                        else:
+                            overlap[names[j]][names[i]] = numpy.ones(len(self.tiles[j]), dtype=bool)
 
         return overlap
 
@@ -14,8 +14,10 @@ from astropy.coordinates import SkyCoord
 import matplotlib.patches
 import matplotlib.path
 import matplotlib.transforms
+import math
 import numpy
-from copy import deepcopy
+from copy import copy, deepcopy
+from numba import njit, prange
 
 from spherical_geometry import polygon as sp
 from lvmsurveysim.utils import plot as lvm_plot
@@ -27,6 +29,122 @@ from . import _VALID_FRAMES
 __all__ = ['SkyRegion']
 
 
+@njit(cache=True)
+def _perimeter_kernel(x, y, n_dl, out_x, out_y):
+    """Fills ``out_x``, ``out_y`` with ``n_dl[i]`` points along each segment ``i``."""
+    j = 0
+    for i in range(len(n_dl)):
+        step_x = (x[i + 1] - x[i]) / n_dl[i]
+        step_y = (y[i + 1] - y[i]) / n_dl[i]
+        for k in range(n_dl[i]):
+            out_x[j] = k * step_x + x[i]
+            out_y[j] = k * step_y + y[i]
+            j += 1
+    return out_x, out_y
+
+
+@njit(cache=True)
+def _cross(a, b):
+    return numpy.array([a[1] * b[2] - a[2] * b[1],
+                        a[2] * b[0] - a[0] * b[2],
+                        a[0] * b[1] - a[1] * b[0]])
+
+
+# Relative error bound of a cross product of two unit vectors computed in
+# double precision, with a wide margin. Crossing tests whose outcome is within
+# this error are left to `spherical_geometry`.
+_CROSS_EPS = 1e-13
+
+
+@njit(cache=True)
+def _norm(a):
+    return math.sqrt(a[0] * a[0] + a[1] * a[1] + a[2] * a[2])
+
+
+@njit(cache=True)
+def _arc_crossing(a, b, c, d, cdx, cd_norm):
+    """Whether the great circle arcs AB and CD cross.
+
+    Same test as the C ufunc `spherical_geometry.great_circle_arc.intersects`,
+    which works in quad-double precision: the arcs cross if the signs of the
+    four endpoint tests agree, arcs that share an endpoint do not cross. The
+    test here is done in double precision, so it only decides when the
+    outcome is well clear of the rounding error. ``cdx`` is the cross product
+    of C and D and ``cd_norm`` its norm.
+
+    Returns 0 if the arcs do not cross, 1 if they cross and 2 if the
+    outcome is not certain and must be left to `spherical_geometry`.
+    """
+    if ((a == c).all() or (a == d).all() or (b == c).all() or (b == d).all() or (a == b).all()):
+        return 2
+    abx = _cross(a, b)
+    ab_norm = _norm(abx)
+    if ab_norm < 1e-6:
+        # The direction of AB x is lost to rounding for very short edges, but
+        # they cannot cross CD if both ends are on the same side of its plane.
+        if abs(numpy.dot(a, cdx)) / cd_norm > 2 * ab_norm + 1e-8:
+            return 0
+        return 2
+    t = _cross(abx, cdx)
+    t_norm = _norm(t)
+    delta = _CROSS_EPS * (1 / ab_norm + 1 / cd_norm)
+    sin_angle = t_norm / (ab_norm * cd_norm)
+    if sin_angle <= delta:
+        return 2
+    tol = delta / sin_angle
+    sign = 0
+    for u in (_cross(abx, a), _cross(b, abx), _cross(cdx, c), _cross(d, cdx)):
+        dot = numpy.dot(u, t) / (_norm(u) * t_norm)
+        if abs(dot) <= tol:
+            return 2
+        s = 1 if dot > 0 else -1
+        if sign == 0:
+            sign = s
+        elif s != sign:
+            return 0
+    return 1
+
+
+@njit(cache=True, parallel=True)
+def _contains_kernel(vertices, inside, points, out):
+    """Tests whether ``points`` are inside a single spherical polygon.
+
+    ``vertices`` is the closed list of unit vectors of the polygon, ``inside``
+    its inside point. As in `spherical_geometry`, a point is inside if the arc
+    from the inside point to it crosses the edges an even number of times.
+    ``out[k]`` is set to 1 if the point is inside, 0 if it is outside and 2 if
+    a crossing could not be decided. Points already inside are skipped, so
+    that ``out`` accumulates the union over several polygons.
+    """
+    for k in prange(points.shape[0]):
+        if out[k] == 1:
+            continue
+        point = points[k]
+        if (point == inside).all():
+            out[k] = 1
+            continue
+        cdx = _cross(inside, point)
+        cd_norm = _norm(cdx)
+        if cd_norm < 1e-6:
+            out[k] = 2
+            continue
+        crossings = 0
+        undecided = False
+        for e in range(vertices.shape[0] - 1):
+            crossing = _arc_crossing(vertices[e], vertices[e + 1], inside, point, cdx, cd_norm)
+            if crossing == 2:
+                undecided = True
+                break
+            crossings += crossing
+        if undecided:
+            out[k] = 2
+        elif crossings % 2 == 0:
+            out[k] = 1
+        elif out[k] != 2:
+            out[k] = 0
+    return out
+
+
 # if we want to inherit: 
 #super(SubClass, self).__init__('x')
 
@@ -136,14 +254,13 @@ class SkyRegion(object):
         """ Return a `~numpy.array` of dimension Nx2 with the N vertices of the 
         SkyRegion.
         """
-        i = self.region.to_lonlat()
-        return numpy.array(next(i)).T        
+        return numpy.array(self._lonlat()).T
 
     def bounds(self):
         """ Return a tuple of the bounds of the SkyRegion defined as the 
         minimum and maximum value of the coordinates in each dimension.
         """
-        x, y = next(self.region.to_lonlat())
+        x, y = self._lonlat()
         return numpy.min(x), numpy.min(y), numpy.max(x), numpy.max(y)
 
     def centroid(self):
@@ -163,27 +280,107 @@ class SkyRegion(object):
         """
         return self.region.contains_lonlat(x, y, degrees=True)
 
+    def contains_points(self, x, y):
+        """ Return a boolean array, True for the points (x,y) inside the region.
+
+        Vectorised version of `.contains_point` for arrays of coordinates in
+        degrees. The crossing test of `spherical_geometry` is repeated in
+        double precision, points for which it is not conclusive (e.g. lying on
+        an edge) are passed to `.contains_point`, so that both always agree.
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        lon = numpy.deg2rad(x)
+        lat = numpy.deg2rad(y)
+        cos_lat = numpy.cos(lat)
+        points = numpy.stack([numpy.cos(lon) * cos_lat, numpy.sin(lon) * cos_lat, numpy.sin(lat)], axis=1)
+
+        out = numpy.zeros(len(points), dtype=numpy.int8)
+        for polygon in self.region.polygons:
+            _contains_kernel(numpy.ascontiguousarray(polygon.points, dtype=float),
+                             numpy.ascontiguousarray(polygon.inside, dtype=float), points, out)
+        for k in numpy.flatnonzero(out == 2):
+            out[k] = self.contains_point(x[k], y[k])
+        return out == 1
+
+    def bounding_cap(self):
+        """ Return a spherical cap that contains the region.
+
+        The cap is centred on the normalised mean of the vertices, and its
+        radius is the largest angular distance to a vertex. It only bounds the
+        region if it is smaller than a hemisphere and contains the inside
+        point of every polygon, otherwise None is returned.
+
+        Returns
+        -------
+        center, cos_radius : `~numpy.array`, float
+            Unit vector of the cap center and cosine of its radius.
+        """
+        return self._cached('bounding_cap', self._bounding_cap)
+
+    def _bounding_cap(self):
+        """ Compute the cap returned by `.bounding_cap`. """
+        points = numpy.concatenate(list(self.region.points))
+        center = points.sum(axis=0)
+        norm = numpy.linalg.norm(center)
+        if norm == 0:
+            return None
+        center /= norm
+
+        cos_radius = numpy.min(points @ center)
+        if cos_radius <= 0:
+            return None
+
+        if numpy.any(numpy.array(list(self.region.inside)) @ center < cos_radius):
+            return None
+
+        return center, cos_radius
+
+    def _lonlat(self):
+        """ Return the lon/lat arrays of the vertices of the first polygon. """
+        return self._cached('lonlat', lambda: next(self.region.to_lonlat()))
+
+    def _cached(self, key, compute):
+        """ Return a quantity derived from ``self.region``, computing it on first use.
+
+        The cache is tied to the polygon object, so it is discarded if ``region``
+        is replaced, for example in the copy returned by `.icrs_region`.
+        """
+        cache = self.__dict__.get('_geometry_cache')
+        if cache is None or cache[0] is not self.region:
+            cache = self._geometry_cache = (self.region, {})
+        if key not in cache[1]:
+            cache[1][key] = compute()
+        return cache[1][key]
+
     def icrs_region(self):
         """ Return a copy of the region transformed into the ICRS system.
 
-        A deep-copy of the region with vertices transformed into the ICRS
-        system is returned if the region is in any other reference frame.
+        A deep-copy of the region is returned if it is already in the ICRS
+        system. Otherwise a copy with vertices and center transformed into the
+        ICRS system is returned, the transformation is done in a single call.
+        The closing vertex of the ring is dropped before the transformation,
+        `~spherical_geometry.polygon.SphericalPolygon.from_radec` closes the
+        polygon again. Passing it through would leave a zero-length edge,
+        which inverts the result of ``contains_point``.
 
         Returns
         -------
             `.SkyRegion` with vertices in the ICRS system.
  
         """
-        r2 = deepcopy(self)
         if self.frame == 'icrs':
-            return r2
+            return deepcopy(self)
         else:
+            # the original polygon is replaced, so it does not need to be copied
+            r2 = copy(self)
             r2.frame = 'icrs'
-            x, y = next(self.region.to_lonlat())
-            c = SkyCoord(self.center[0]*u.deg, self.center[1]*u.deg).transform_to('icrs')
-            s = SkyCoord(x*u.deg, y*u.deg, frame=self.frame).transform_to('icrs')
-            r2.center = [c.ra.deg, c.dec.deg]
-            r2.region = sp.SphericalPolygon.from_radec(s.ra.deg, s.dec.deg, degrees=True)
+            x, y = self._lonlat()
+            x, y = x[:-1], y[:-1]
+            s = SkyCoord(numpy.append(x, self.center[0])*u.deg, numpy.append(y, self.center[1])*u.deg,
+                         frame=self.frame).transform_to('icrs')
+            r2.center = [s.ra.deg[-1], s.dec.deg[-1]]
+            r2.region = sp.SphericalPolygon.from_radec(s.ra.deg[:-1], s.dec.deg[:-1], degrees=True)
             return r2
 
 
@@ -221,26 +418,15 @@ class SkyRegion(object):
         xp, yp : `~numpy.array`
             coordinates of new vertices
         """
-        xp = numpy.array([])
-        yp = numpy.array([])
-        for x1,x2,y1,y2 in zip(x[:-1], x[1:], y[:-1], y[1:]):
-            # Calculate the length of a segment, hopefully in degrees
-            dl = ((x2-x1)**2 + (y2-y1)**2)**0.5
-            n_dl = numpy.max([int(dl/n), min_points])
-            
-            if x1 != x2:
-                m = (y2-y1)/(x2-x1)
-                b = y2 - m*x2
-                interp_x = numpy.linspace(x1, x2, num=n_dl, endpoint=False)
-                interp_y = interp_x * m + b
-            else:
-                interp_x = numpy.full(n_dl, x1)
-                interp_y = numpy.linspace(y1,y2, n_dl, endpoint=False)
-
-            xp = numpy.append(xp, interp_x)
-            yp = numpy.append(yp, interp_y)
-
-        return xp, yp
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+
+        # number of points per segment, from its length hopefully in degrees. The
+        # endpoint of each segment is the start of the next one.
+        n_dl = numpy.maximum((numpy.hypot(numpy.diff(x), numpy.diff(y)) / n).astype(int), min_points)
+
+        total = n_dl.sum()
+        return _perimeter_kernel(x, y, n_dl, numpy.empty(total), numpy.empty(total))
 
 
     def plot(self, ax=None, projection='rectangular', return_patch=False, **kwargs):
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# @Filename: test_scheduler.py
+# @License: BSD 3-Clause
+
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import numpy
+import pytest
+
+from lvmsurveysim.schedule.scheduler import _best_in_groups, _priority_groups, _select_tile
+
+
+def _select_reference(valid_mask, hz, hz_limit, observed, total_exp, target_prio, tile_prio, alt):
+    """ The tile selection as a loop over priorities, with plain numpy. """
+
+    with numpy.errstate(invalid='ignore'):
+        valid_idx = numpy.flatnonzero(valid_mask & (hz > hz_limit))
+    if len(valid_idx) == 0:
+        return -1
+
+    # incomplete tiles go first, as if their target had the highest priority
+    incomplete = (observed > 0) & (observed < total_exp)
+    prio = target_prio[valid_idx].astype(int)
+    prio[incomplete[valid_idx]] = target_prio.max() + 1
+
+    best = numpy.flatnonzero(prio == prio.max())
+    best = best[tile_prio[valid_idx][best] == tile_prio[valid_idx][best].max()]
+    return valid_idx[best[alt[valid_idx][best].argmax()]]
+
+
+def _select(valid_mask, hz, hz_limit, observed, target_prio, tile_prio, alt):
+    tile_order, tile_bounds = _priority_groups(tile_prio)
+    prio_order, prio_bounds = _priority_groups(target_prio, tile_prio)
+    return _select_tile(valid_mask, hz, hz_limit, observed, alt,
+                        tile_order, tile_bounds, prio_order, prio_bounds)
+
+
+def test_priority_groups():
+
+    target_prio = numpy.array([1, 3, 1, 2, 3, 1])
+    tile_prio = numpy.array([0, 0, 1, 0, 0, 1])
+
+    order, bounds = _priority_groups(target_prio, tile_prio)
+
+    groups = [list(order[bounds[g]:bounds[g + 1]]) for g in range(len(bounds) - 1)]
+    assert groups == [[1, 4], [3], [2, 5], [0]]
+
+
+def test_select_tile_ties():
+
+    # Same priorities and altitude, the first tile wins.
+    n = 4
+    alt = numpy.array([0.5, 0.8, 0.8, 0.2])
+    idx, obs_alt = _select(numpy.ones(n, dtype=bool), numpy.ones(n), numpy.zeros(n), numpy.zeros(n),
+                           numpy.zeros(n, dtype=int), numpy.zeros(n, dtype=int), alt)
+    assert idx == 1
+    assert obs_alt == pytest.approx(0.8)
+
+
+def test_select_tile_incomplete_first():
+
+    # The started tile of a low priority target is preferred to the others.
+    n = 3
+    observed = numpy.array([0., 1., 0.])
+    target_prio = numpy.array([5, 0, 5])
+    idx, _ = _select(numpy.ones(n, dtype=bool), numpy.ones(n), numpy.zeros(n), observed,
+                     target_prio, numpy.zeros(n, dtype=int), numpy.array([0.9, 0.1, 0.8]))
+    assert idx == 1
+
+
+def test_select_tile_nan_shadow_height():
+
+    # A NaN shadow height makes the tile not viable.
+    n = 3
+    hz = numpy.array([numpy.nan, 1., 1.])
+    idx, _ = _select(numpy.ones(n, dtype=bool), hz, numpy.zeros(n), numpy.zeros(n),
+                     numpy.array([2, 1, 1]), numpy.zeros(n, dtype=int), numpy.array([0.9, 0.1, 0.8]))
+    assert idx == 2
+
+
+def test_select_tile_none_viable():
+
+    n = 3
+    hz = numpy.array([numpy.nan, -1., 1.])
+    valid_mask = numpy.array([True, True, False])
+    idx, _ = _select(valid_mask, hz, numpy.zeros(n), numpy.zeros(n),
+                     numpy.zeros(n, dtype=int), numpy.zeros(n, dtype=int), numpy.ones(n))
+    assert idx == -1
+
+    order, bounds = _priority_groups(numpy.zeros(0, dtype=int))
+    assert _best_in_groups(order, bounds, False, numpy.zeros(0, dtype=bool), numpy.zeros(0),
+                           numpy.zeros(0), numpy.zeros(0), numpy.zeros(0))[0] == -1
+
+
+def test_select_tile_reference():
+
+    rng = numpy.random.default_rng(1)
+    for _ in range(500):
+        n = rng.integers(0, 40)
+        target_prio = rng.integers(-2, 4, n)
+        tile_prio = rng.integers(0, 3, n)
+        alt = rng.integers(0, 5, n).astype(float)
+        total_exp = numpy.full(n, 3.)
+        observed = rng.integers(0, 4, n).astype(float)
+        hz = rng.normal(size=n)
+        hz[rng.random(n) < 0.1] = numpy.nan
+        hz_limit = numpy.zeros(n)
+        valid_mask = (rng.random(n) < 0.6) & (observed < total_exp)
+
+        idx, _ = _select(valid_mask, hz, hz_limit, observed, target_prio, tile_prio, alt)
+        assert idx == _select_reference(valid_mask, hz, hz_limit, observed, total_exp,
+                                         target_prio, tile_prio, alt)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# @Filename: test_tiledb.py
+# @License: BSD 3-Clause
+
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import numpy
+
+from lvmsurveysim.schedule.tiledb import TileDB
+from lvmsurveysim.target.skyregion import SkyRegion
+
+
+def test_caps_disjoint():
+
+    # Disjoint caps must imply that the regions do not intersect, also for the
+    # ICRS copies of galactic regions, which the overlap loop uses.
+    rng = numpy.random.default_rng(0)
+    regions = []
+    for frame in ['icrs', 'galactic']:
+        for lon, lat in zip(rng.uniform(270., 290., 8), rng.uniform(-10., 10., 8)):
+            regions.append(SkyRegion('circle', [lon, lat], r=2., frame=frame))
+            regions.append(SkyRegion('ellipse', [lon, lat], a=3., b=1., pa=30., frame=frame))
+    regions = [region.icrs_region() for region in regions]
+    caps = [region.bounding_cap() for region in regions]
+
+    n_disjoint = 0
+    n_intersect = 0
+    for i in range(len(regions)):
+        for j in range(i + 1, len(regions)):
+            intersects = regions[i].intersects_poly(regions[j])
+            n_intersect += intersects
+            if TileDB._caps_disjoint(caps[i], caps[j]):
+                n_disjoint += 1
+                assert not intersects
+
+    assert n_disjoint > 0 and n_intersect > 0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# @Filename: test_skyregion.py
+# @License: BSD 3-Clause
+
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import numpy
+import pytest
+
+from spherical_geometry import polygon as sp
+
+from lvmsurveysim.target.skyregion import SkyRegion
+
+
+galactic_regions = [
+    ('circle', [280., -5.], dict(r=2.)),
+    ('ellipse', [280., -5.], dict(a=3., b=1., pa=20.)),
+    ('rectangle', [30., 60.], dict(width=4., height=2., pa=10.)),
+    ('circle', [10., 85.], dict(r=8.)),
+]
+
+
+@pytest.mark.parametrize(('typ', 'coords', 'kwargs'), galactic_regions)
+def test_icrs_region_galactic(typ, coords, kwargs):
+
+    region = SkyRegion(typ, coords, frame='galactic', **kwargs)
+    icrs = region.icrs_region()
+
+    assert icrs.frame == 'icrs'
+
+    # The ring must not contain a zero-length edge, that inverts contains_point.
+    points = icrs.region.polygons[0].points
+    assert numpy.linalg.norm(numpy.diff(points, axis=0), axis=1).min() > 0
+
+    assert icrs.region.contains_lonlat(icrs.center[0], icrs.center[1], degrees=True)
+    assert icrs.region.area() == pytest.approx(region.region.area())
+
+    # Points far from the region must not be contained.
+    cap = icrs.bounding_cap()
+    assert cap is not None
+    center, cos_radius = cap
+    lon = numpy.linspace(0., 350., 36)
+    lat = numpy.linspace(-80., 80., 9)
+    for x in lon:
+        for y in lat:
+            xyz = numpy.array([numpy.cos(numpy.radians(y)) * numpy.cos(numpy.radians(x)),
+                               numpy.cos(numpy.radians(y)) * numpy.sin(numpy.radians(x)),
+                               numpy.sin(numpy.radians(y))])
+            if numpy.dot(xyz, center) < cos_radius:
+                assert not icrs.region.contains_lonlat(x, y, degrees=True)
+
+
+def _sample_points(region, n=2000, seed=0):
+    """ Random points around a region, plus its vertices and edge midpoints. """
+    rng = numpy.random.default_rng(seed)
+    lon0, lat0 = region.center
+    y = lat0 + rng.uniform(-10., 10., n)
+    x = lon0 + rng.uniform(-10., 10., n) / numpy.cos(numpy.radians(y))
+    vx, vy = next(region.region.to_lonlat())
+    x = numpy.concatenate([x, vx, (vx[:-1] + vx[1:]) / 2])
+    y = numpy.concatenate([y, vy, (vy[:-1] + vy[1:]) / 2])
+    return x, y
+
+
+@pytest.mark.parametrize('frame', ['icrs', 'galactic'])
+@pytest.mark.parametrize(('typ', 'coords', 'kwargs'), galactic_regions)
+def test_contains_points(typ, coords, kwargs, frame):
+
+    region = SkyRegion(typ, coords, frame=frame, **kwargs)
+
+    for reg in [region, region.icrs_region()]:
+        x, y = _sample_points(reg)
+        inside = reg.contains_points(x, y)
+        assert inside.any() and not inside.all()
+        assert list(inside) == [reg.contains_point(xx, yy) for xx, yy in zip(x, y)]
+
+
+def test_contains_points_zero_length_edge():
+
+    # A duplicated vertex gives a zero-length edge, which spherical_geometry
+    # counts as crossed by every arc. contains_points must follow it.
+    polygon = sp.SphericalPolygon.from_radec([10., 12., 12., 12., 10.], [0., 0., 2., 2., 2.],
+                                             center=(11., 1.), degrees=True)
+    region = SkyRegion('raw', polygon, frame='icrs')
+
+    x, y = _sample_points(region, n=500)
+    inside = region.contains_points(x, y)
+    assert list(inside) == [region.contains_point(xx, yy) for xx, yy in zip(x, y)]
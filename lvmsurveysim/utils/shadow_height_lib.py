@@ -147,11 +147,14 @@ class shadow_calc(object):
         self.v = -1.0*(self.xyz_earth - self.xyz_sun)/np.sqrt(np.sum(np.square(self.xyz_earth-self.xyz_sun)))
         self.xyz_c = self.xyz_earth - self.v * self.d_ec.to("au").value
 
-    def solve_for_height(self, mask=None, unit="km"):
-        if mask is None:
-            mask = np.full(len(self.pointing_unit_vectors), True)
-
-        puv = self.pointing_unit_vectors[mask]
+    def solve_for_height(self, mask=None, unit="km", indices=None):
+        # indices selects the pointings directly, avoiding a pass over a full-length mask
+        if indices is not None:
+            puv = self.pointing_unit_vectors[indices]
+        else:
+            if mask is None:
+                mask = np.full(len(self.pointing_unit_vectors), True)
+            puv = self.pointing_unit_vectors[mask]
 
         self.a = np.square(np.sum(puv*self.v,axis=1)) -  self.shadow_cone_cos_theta_sqr
         self.b = 2*( np.sum(puv*self.v, axis=1) * np.sum(self.co*self.v) - np.sum(puv*self.co, axis=1)*self.shadow_cone_cos_theta_sqr)
@@ -177,11 +180,11 @@ class shadow_calc(object):
 
         self.heights = (self.vecmag(pointing_xyz - self.xyz_earth)*u.au - self.earth_radius).to(unit).value
 
-    def get_heights(self, mask=None, jd=None, return_heights=True,unit=u.km):
+    def get_heights(self, mask=None, jd=None, return_heights=True,unit=u.km, indices=None):
         if jd is not None:
             self.jd = jd
             self.update_time()
-        self.solve_for_height(mask=mask, unit=unit)
+        self.solve_for_height(mask=mask, unit=unit, indices=indices)
         if return_heights:
             return self.heights 
 
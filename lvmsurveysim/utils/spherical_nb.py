@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# @Filename: spherical_nb.py
+# @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
+
+# Numba versions of some of the functions in spherical.py, specialised for
+# computing distances from one point to many points whose trigonometry is cached.
+
+import math
+
+from numba import njit, prange
+
+__all__ = ['gcd_one_to_many']
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def gcd_one_to_many(ra0, dec0, sin_dec, cos_dec, ra_rad, out):
+    """Great circle distance from one point to many points.
+
+    Parameters
+    ----------
+    ra0,dec0 : float
+        The RA and Dec coordinates of the single point. In radians.
+    sin_dec,cos_dec : ~numpy.ndarray
+        The sine and cosine of the declinations of the other points.
+    ra_rad : ~numpy.ndarray
+        The RA of the other points, in radians.
+    out : ~numpy.ndarray
+        Array of the same length as ``ra_rad`` in which the result is written.
+
+    Returns
+    -------
+    separation : `~numpy.ndarray`
+        ``out``, with the separations in degrees.
+
+    """
+
+    sin_dec0 = math.sin(dec0)
+    cos_dec0 = math.cos(dec0)
+
+    for i in prange(len(ra_rad)):
+        val = sin_dec0 * sin_dec[i] + cos_dec0 * cos_dec[i] * math.cos(ra0 - ra_rad[i])
+        out[i] = math.degrees(math.acos(min(val, 1.0)))
+
+    return out